@@ -1,10 +1,25 @@
 import json
 import logging
 import os
+import threading
+import time
+from collections.abc import Callable, Iterator
 from datetime import datetime, timedelta
 from typing import Any, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -15,8 +30,21 @@ class ZohoClient:
 
     BASE_URL = "https://www.zohoapis.com/books/v3"
     TOKEN_URL = "https://accounts.zoho.com/oauth/v2/token"
-
-    def __init__(self, client_id: str, client_secret: str, redirect_uri: str, organization_id: str) -> None:
+    REFRESH_RETRY_COOLDOWN = 30
+    UNAUTHORIZED_REFRESH_MIN_INTERVAL = 60
+    PER_PAGE = 200
+
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        redirect_uri: str,
+        organization_id: str,
+        refresh_buffer_seconds: int = 300,
+        refresh_buffer_ratio: float = 0.0,
+        code_provider: Callable[[], str] | None = None,
+        lazy_auth: bool = True,
+    ) -> None:
         """
         Initialize the ZohoClient.
 
@@ -24,6 +52,10 @@ class ZohoClient:
         :param client_secret: Zoho client secret
         :param redirect_uri: Redirect URI for OAuth
         :param organization_id: Zoho organization ID
+        :param refresh_buffer_seconds: Refresh the access token this many seconds before it expires
+        :param refresh_buffer_ratio: Refresh the access token when this fraction of its lifetime remains
+        :param code_provider: Callable returning an authorization code, used instead of prompting on stdin
+        :param lazy_auth: Defer authorization until the first API request instead of doing it here
         """
         self.client_id = client_id
         self.client_secret = client_secret
@@ -33,9 +65,62 @@ class ZohoClient:
         self.access_token: Optional[str] = None
         self.refresh_token: Optional[str] = None
         self.token_expiry: Optional[datetime] = None
+        self.refresh_buffer_seconds = refresh_buffer_seconds
+        self.refresh_buffer_ratio = refresh_buffer_ratio
+        self.code_provider = code_provider
+        self._auth_checked = False
+        self._last_refresh_failure_ts: Optional[float] = None
+        self._refresh_after_monotonic = 0.0
+        self._expiry_monotonic = 0.0
+        self._issued_monotonic = 0.0
+        self._auth_header: Optional[str] = None
+        self._token_lock = threading.RLock()
+        self._base_headers = {"Content-Type": "application/json;charset=UTF-8"}
+        self._base_url_prefix = self.BASE_URL + "/"
+        self._url_invoices = self._base_url_prefix + "invoices"
+        self._url_items = self._base_url_prefix + "items"
+        self._url_contacts = self._base_url_prefix + "contacts"
+        self._url_invoice_prefix = self._url_invoices + "/"
+        self._url_item_prefix = self._url_items + "/"
+        self._url_contact_prefix = self._url_contacts + "/"
         self.logger = logging.getLogger(__name__)
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=10,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=[502, 503, 504],
+                raise_on_status=False,
+            ),
+        )
+        self._session.mount("https://", adapter)
+        self._session.headers.update(self._base_headers)
         self._load_refresh_token()
-        self._ensure_auth()
+        if not lazy_auth:
+            self._ensure_auth()
+
+    def __enter__(self) -> "ZohoClient":
+        """Return the client for use as a context manager."""
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Close the client when leaving the context manager."""
+        self.close()
+
+    @property
+    def organization_id(self) -> str:
+        """Zoho organization ID sent with every API request."""
+        return self._base_params["organization_id"]
+
+    @organization_id.setter
+    def organization_id(self, organization_id: str) -> None:
+        self._base_params = {"organization_id": organization_id}
+
+    def close(self) -> None:
+        """Close the underlying HTTP session and release pooled connections."""
+        self._session.close()
 
     def get_grant_token(self, code: str) -> bool:
         """
@@ -52,13 +137,12 @@ class ZohoClient:
             "grant_type": "authorization_code",
         }
 
-        response = requests.post(self.TOKEN_URL, params=params)
+        response = self._session.post(self.TOKEN_URL, params=params)
 
         if response.status_code == 200:
             data = response.json()
-            self.access_token = data.get("access_token")
             self.refresh_token = data.get("refresh_token")
-            self.token_expiry = datetime.now() + timedelta(seconds=data.get("expires_in", 3600))
+            self._set_access_token(data.get("access_token"), data.get("expires_in", 3600))
             self._store_refresh_token()
             self.logger.info("Successfully obtained grant token and refresh token.")
             return True
@@ -88,12 +172,11 @@ class ZohoClient:
             "grant_type": "refresh_token",
         }
 
-        response = requests.post(self.TOKEN_URL, params=params)
+        response = self._session.post(self.TOKEN_URL, params=params)
 
         if response.status_code == 200:
             data = response.json()
-            self.access_token = data.get("access_token")
-            self.token_expiry = datetime.now() + timedelta(seconds=data.get("expires_in", 3600))
+            self._set_access_token(data.get("access_token"), data.get("expires_in", 3600))
             self.logger.info("Successfully refreshed access token.")
             return True
         else:
@@ -101,28 +184,78 @@ class ZohoClient:
             self.logger.error(f"Response: {response.text}")
             return False
 
+    def _set_access_token(self, access_token: str | None, expires_in: int) -> None:
+        """
+        Record a newly issued access token and its lifetime.
+
+        The token is scheduled for refresh ahead of its real expiry, so it is never
+        handed out for a request that may cross the expiry mid-flight.
+
+        :param access_token: Access token
+        :param expires_in: Token lifetime in seconds
+        """
+        # Never schedule the refresh earlier than halfway through the token's lifetime,
+        # otherwise an oversized buffer would refresh on every request.
+        threshold = max(self.refresh_buffer_seconds, self.refresh_buffer_ratio * expires_in)
+        threshold = min(threshold, expires_in * 0.5)
+        with self._token_lock:
+            self.access_token = access_token
+            self._auth_header = f"Zoho-oauthtoken {access_token}" if access_token else None
+            self.token_expiry = datetime.now() + timedelta(seconds=expires_in)
+            self._issued_monotonic = time.monotonic()
+            self._expiry_monotonic = self._issued_monotonic + expires_in
+            self._refresh_after_monotonic = self._expiry_monotonic - threshold
+
     def _store_refresh_token(self) -> None:
-        """Store the refresh token in a local file."""
-        with open(self.temp_file, "w") as f:
+        """
+        Store the refresh token in a local file.
+
+        The token is written to a temporary file which then atomically replaces the
+        real one, so a crash mid-write never leaves a truncated token file behind.
+        """
+        tmp = self.temp_file + ".tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        if hasattr(os, "fchmod"):
+            # The mode above only applies on creation; a stale tmp file keeps its old permissions.
+            os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "w") as f:
             json.dump({"refresh_token": self.refresh_token}, f)
+            f.flush()
+            try:
+                os.fsync(f.fileno())
+            except OSError as e:
+                self.logger.warning(f"Could not fsync {tmp}: {e}")
+        os.replace(tmp, self.temp_file)
 
     def _load_refresh_token(self) -> None:
-        """Load the refresh token from a local file."""
-        if os.path.exists(self.temp_file):
-            with open(self.temp_file) as f:
-                data = json.load(f)
-                self.refresh_token = data.get("refresh_token")
+        """Load the refresh token from a local file, recovering from an interrupted write if needed."""
+        for path in (self.temp_file, self.temp_file + ".tmp"):
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Could not read refresh token from {path}: {e}")
+                continue
+            self.refresh_token = data.get("refresh_token")
+            return
 
     def _ensure_auth(self) -> None:
         """
         Ensure that we have a valid refresh token and access token.
         """
-        if not self.refresh_token:
-            self.logger.info("No refresh token found. Please authorize the application.")
-            code = input("Enter the authorization code: ")
-            if not self.get_grant_token(code):
-                raise ValueError("Failed to obtain grant token.")
-        self._ensure_valid_token()
+        with self._token_lock:
+            if not self.refresh_token:
+                self.logger.info("No refresh token found. Please authorize the application.")
+                if self.code_provider is not None:
+                    code = self.code_provider()
+                else:
+                    code = input("Enter the authorization code: ")
+                if not self.get_grant_token(code):
+                    raise ValueError("Failed to obtain grant token.")
+            self._ensure_valid_token()
+            self._auth_checked = True
 
     def _ensure_valid_token(self) -> bool:
         """
@@ -130,9 +263,58 @@ class ZohoClient:
 
         :return: True if a valid token is available, False otherwise
         """
-        if not self.access_token or (self.token_expiry and datetime.now() >= self.token_expiry):
+        if self._auth_header is not None and time.monotonic() < self._refresh_after_monotonic:
+            return True
+
+        with self._token_lock:
+            # Another thread may have refreshed the token while we waited for the lock.
+            if self._auth_header is not None and time.monotonic() < self._refresh_after_monotonic:
+                return True
+            return self._refresh_if_due()
+
+    def _refresh_if_due(self) -> bool:
+        """
+        Refresh the access token if it is missing or inside its refresh buffer.
+
+        Must be called with the token lock held.
+
+        :return: True if a valid token is available, False otherwise
+        """
+        if self._auth_header is None:
             return self.refresh_access_token()
-        return True
+
+        now = time.monotonic()
+        if now < self._refresh_after_monotonic:
+            return True
+
+        # The token is inside its refresh buffer. While it is still usable, a failed
+        # refresh falls back to the cached token and is retried after a cooldown.
+        still_valid = now < self._expiry_monotonic
+        if (
+            still_valid
+            and self._last_refresh_failure_ts is not None
+            and now - self._last_refresh_failure_ts < self.REFRESH_RETRY_COOLDOWN
+        ):
+            return True
+
+        try:
+            refreshed = self.refresh_access_token()
+        except requests.exceptions.RequestException as e:
+            if not still_valid:
+                raise
+            self.logger.error(f"Token refresh request failed: {e}")
+            refreshed = False
+
+        if refreshed:
+            self._last_refresh_failure_ts = None
+            return True
+        if still_valid:
+            self._last_refresh_failure_ts = time.monotonic()
+            self.logger.warning(
+                "Proactive token refresh failed, using the cached access token until it expires."
+            )
+            return True
+        return False
 
     def get_access_token(self) -> str | None:
         """
@@ -140,34 +322,87 @@ class ZohoClient:
 
         :return: Access token if available, None otherwise
         """
+        if not self._auth_checked:
+            self._ensure_auth()
         if self._ensure_valid_token():
             return self.access_token
         return None
 
+    def _refresh_rejected_token(self, rejected_header: str) -> bool:
+        """
+        Refresh the access token after the API rejected it with a 401.
+
+        Zoho also answers 401 for permission errors, so a freshly issued token is not
+        refreshed again; otherwise repeated calls to a forbidden endpoint would hit the
+        token endpoint's rate limit.
+
+        :param rejected_header: Authorization header that was rejected
+        :return: True if a new token is available, False otherwise
+        """
+        with self._token_lock:
+            if self._auth_header != rejected_header:
+                # Another thread already replaced the rejected token.
+                return self._auth_header is not None
+            if time.monotonic() - self._issued_monotonic < self.UNAUTHORIZED_REFRESH_MIN_INTERVAL:
+                self.logger.warning("Recently issued access token was rejected, not refreshing it again.")
+                return False
+            return self.refresh_access_token()
+
     def _make_request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
         """
         Make an authenticated request to the Zoho Books API.
 
+        The built-in endpoint methods call _make_request_fast with precomputed URLs;
+        this is kept for requests to any other endpoint, including from subclasses.
+
         :param method: HTTP method (GET, POST, etc.)
         :param endpoint: API endpoint
         :param kwargs: Additional arguments for the request
         :return: Response object
         """
-        access_token = self.get_access_token()
-        if not access_token:
+        return self._make_request_fast(method, self._base_url_prefix + endpoint, **kwargs)
+
+    def _make_request_fast(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Make an authenticated request to an already joined Zoho Books API URL.
+
+        :param method: HTTP method (GET, POST, etc.)
+        :param url: Full API URL
+        :param kwargs: Additional arguments for the request
+        :return: Response object
+        """
+        if not self._auth_checked:
+            self._ensure_auth()
+        if not self._ensure_valid_token():
             self.logger.error("Failed to obtain a valid access token.")
             raise ValueError("Failed to obtain a valid access token.")
 
-        url = f"{self.BASE_URL}/{endpoint}"
-        headers = {
-            "Authorization": f"Zoho-oauthtoken {access_token}",
-            "Content-Type": "application/json;charset=UTF-8",
-        }
-        params = kwargs.pop("params", {})
-        params["organization_id"] = self.organization_id
+        auth_header = self._auth_header
+        caller_params = kwargs.pop("params", None)
+        params = {**caller_params, **self._base_params} if caller_params else self._base_params
+        if orjson is not None and kwargs.get("json") is not None:
+            # The session already sends a JSON Content-Type, so the pre-encoded body needs no
+            # extra header. Non-str keys are stringified like json.dumps does; bodies orjson
+            # still rejects are left to requests. Unlike json.dumps, orjson encodes NaN and
+            # Infinity as null and serializes datetime, date and UUID values.
+            try:
+                kwargs["data"] = orjson.dumps(kwargs["json"], option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                pass
+            else:
+                del kwargs["json"]
 
         self.logger.info(f"Making {method} request to {url}")
-        response = requests.request(method, url, headers=headers, params=params, **kwargs)
+        response = self._session.request(
+            method, url, headers={"Authorization": auth_header}, params=params, **kwargs
+        )
+
+        if response.status_code == 401 and self._refresh_rejected_token(auth_header):
+            self.logger.info(f"Access token rejected, retrying {method} request to {url}")
+            response.close()
+            response = self._session.request(
+                method, url, headers={"Authorization": self._auth_header}, params=params, **kwargs
+            )
 
         try:
             response.raise_for_status()
@@ -179,14 +414,71 @@ class ZohoClient:
         self.logger.info(f"Request to {url} successful")
         return response
 
+    def _parse_json(self, response: requests.Response) -> Any:
+        """
+        Parse a JSON response body, using orjson when it is installed.
+
+        :param response: Response object
+        :return: Parsed JSON data
+        """
+        if orjson is not None:
+            return orjson.loads(response.content)
+        return response.json()
+
+    def _iter_list(self, url: str, key: str) -> Iterator[dict[str, Any]]:
+        """
+        Iterate over every record of a list endpoint, following pagination.
+
+        When ijson is installed each page is parsed incrementally from the response
+        stream, so only one record at a time is held in memory.
+
+        :param url: Full URL of the list endpoint
+        :param key: Key of the record list in the response body
+        :return: Iterator of record dictionaries
+        """
+        item_prefix = f"{key}.item"
+        page = 1
+        while True:
+            has_more_page = False
+            params = {"page": page, "per_page": self.PER_PAGE}
+            with self._make_request_fast("GET", url, params=params, stream=True) as response:
+                if ijson is None:
+                    data = self._parse_json(response)
+                    yield from data.get(key, [])
+                    has_more_page = data.get("page_context", {}).get("has_more_page", False)
+                else:
+                    response.raw.decode_content = True
+                    builder = None
+                    for prefix, event, value in ijson.parse(response.raw, use_float=True):
+                        if builder is not None:
+                            builder.event(event, value)
+                            if prefix == item_prefix and event == "end_map":
+                                yield builder.value
+                                builder = None
+                        elif prefix == item_prefix and event == "start_map":
+                            builder = ijson.ObjectBuilder()
+                            builder.event(event, value)
+                        elif prefix == "page_context.has_more_page":
+                            has_more_page = value
+            if not has_more_page:
+                return
+            page += 1
+
+    def list_invoices_iter(self) -> Iterator[dict[str, Any]]:
+        """
+        Iterate over all invoices.
+
+        :return: Iterator of invoice dictionaries
+        """
+        return self._iter_list(self._url_invoices, "invoices")
+
     def list_invoices(self) -> list[dict[str, Any]]:
         """
         List all invoices.
 
         :return: List of invoice dictionaries
         """
-        response = self._make_request("GET", "invoices")
-        return response.json().get("invoices", [])
+        return list(self.list_invoices_iter())
 
     def download_invoice(self, invoice_id: str) -> None:
         """
@@ -194,9 +486,22 @@ class ZohoClient:
 
         :param invoice_id: ID of the invoice to download
         """
-        response = self._make_request("GET", f"invoices/{invoice_id}", params={"accept": "pdf"})
-        with open(f"{invoice_id}.pdf", "wb") as f:
-            f.write(response.content)
+        response = self._make_request_fast(
+            "GET", self._url_invoice_prefix + str(invoice_id), params={"accept": "pdf"}, stream=True
+        )
+        path = f"{invoice_id}.pdf"
+        part = path + ".part"
+        try:
+            with response, open(part, "wb") as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    if chunk:
+                        f.write(chunk)
+            os.replace(part, path)
+        except BaseException:
+            # Never leave a truncated PDF behind if the download is interrupted.
+            if os.path.exists(part):
+                os.unlink(part)
+            raise
         self.logger.info(f"Invoice PDF downloaded successfully as {invoice_id}.pdf")
 
     def create_item(self, name: str, rate: float, description: str = "") -> str | None:
@@ -213,7 +518,7 @@ class ZohoClient:
             "rate": rate,
             "description": description,
         }
-        response = self._make_request("POST", "items", json=data)
+        response = self._make_request_fast("POST", self._url_items, json=data)
         return response.json().get("item", {}).get("item_id")
 
     def get_item(self, item_id: str) -> dict[str, Any] | None:
@@ -223,44 +528,56 @@ class ZohoClient:
         :param item_id: ID of the item to retrieve
         :return: Item details dictionary if found, None otherwise
         """
-        response = self._make_request("GET", f"items/{item_id}")
+        response = self._make_request_fast("GET", self._url_item_prefix + str(item_id))
         return response.json().get("item", {})
 
+    def list_items_iter(self) -> Iterator[dict[str, Any]]:
+        """
+        Iterate over all items.
+
+        :return: Iterator of item dictionaries
+        """
+        return self._iter_list(self._url_items, "items")
+
     def list_items(self) -> list[dict[str, Any]]:
         """
         List all items.
 
         :return: List of item dictionaries
         """
-        response = self._make_request("GET", "items")
-        return response.json().get("items", [])
+        return list(self.list_items_iter())
 
-    def create_invoice(self, customer_id: str, items: list[str], quantities: list[int]) -> str | None:
+    def create_invoice(
+        self,
+        customer_id: str,
+        items: list[str],
+        quantities: list[int],
+        item_overrides: dict[str, dict[str, Any]] | None = None,
+    ) -> str | None:
         """
         Create a new invoice.
 
+        Line items are sent as item ID and quantity only, letting Zoho fill in the name,
+        description and rate from the item master. Fields given in ``item_overrides`` are
+        sent along with the line item to replace the master values.
+
         :param customer_id: ID of the customer
         :param items: List of item IDs
         :param quantities: List of quantities corresponding to the items
+        :param item_overrides: Optional mapping of item ID to line item fields to override
         :return: Invoice ID if created successfully, None otherwise
         """
-        line_items = []
-        for item_id, quantity in zip(items, quantities, strict=False):
-            item = self.get_item(item_id)
-            if item:
-                line_items.append({
-                    "item_id": item_id,
-                    "name": item.get("name"),
-                    "description": item.get("description"),
-                    "rate": item.get("rate"),
-                    "quantity": quantity
-                })
+        item_overrides = item_overrides or {}
+        line_items = [
+            {"item_id": item_id, **item_overrides.get(item_id, {}), "quantity": quantity}
+            for item_id, quantity in zip(items, quantities, strict=False)
+        ]
 
         data = {
             "customer_id": customer_id,
             "line_items": line_items
         }
-        response = self._make_request("POST", "invoices", json=data)
+        response = self._make_request_fast("POST", self._url_invoices, json=data)
         return response.json().get("invoice", {}).get("invoice_id")
 
     def create_contact(self, contact_data: dict[str, Any]) -> str | None:
@@ -270,17 +587,24 @@ class ZohoClient:
         :param contact_data: Dictionary containing contact information
         :return: Contact ID if created successfully, None otherwise
         """
-        response = self._make_request("POST", "contacts", json=contact_data)
+        response = self._make_request_fast("POST", self._url_contacts, json=contact_data)
         return response.json().get("contact", {}).get("contact_id")
 
+    def list_contacts_iter(self) -> Iterator[dict[str, Any]]:
+        """
+        Iterate over all contacts.
+
+        :return: Iterator of contact dictionaries
+        """
+        return self._iter_list(self._url_contacts, "contacts")
+
     def list_contacts(self) -> list[dict[str, Any]]:
         """
         List all contacts.
 
         :return: List of contact dictionaries
         """
-        response = self._make_request("GET", "contacts")
-        return response.json().get("contacts", [])
+        return list(self.list_contacts_iter())
 
     def get_contact(self, contact_id: str) -> dict[str, Any] | None:
         """
@@ -289,9 +613,21 @@ class ZohoClient:
         :param contact_id: ID of the contact to retrieve
         :return: Contact details dictionary if found, None otherwise
         """
-        response = self._make_request("GET", f"contacts/{contact_id}")
+        response = self._make_request_fast("GET", self._url_contact_prefix + str(contact_id))
         return response.json().get("contact", {})
 
+    def _set_contact_status(self, contact_id: str, active: bool) -> bool:
+        """
+        Mark a contact as active or inactive.
+
+        :param contact_id: ID of the contact to update
+        :param active: True to mark the contact as active, False for inactive
+        :return: True if successful, False otherwise
+        """
+        suffix = "/active" if active else "/inactive"
+        response = self._make_request_fast("POST", self._url_contact_prefix + str(contact_id) + suffix)
+        return response.status_code == 200
+
     def mark_contact_active(self, contact_id: str) -> bool:
         """
         Mark a contact as active.
@@ -299,8 +635,7 @@ class ZohoClient:
         :param contact_id: ID of the contact to mark as active
         :return: True if successful, False otherwise
         """
-        response = self._make_request("POST", f"contacts/{contact_id}/active")
-        return response.status_code == 200
+        return self._set_contact_status(contact_id, True)
 
     def mark_contact_inactive(self, contact_id: str) -> bool:
         """
@@ -309,10 +644,10 @@ class ZohoClient:
         :param contact_id: ID of the contact to mark as inactive
         :return: True if successful, False otherwise
         """
-        response = self._make_request("POST", f"contacts/{contact_id}/inactive")
-        return response.status_code == 200
+        return self._set_contact_status(contact_id, False)
 
 
 
 if __name__ == "__main__":
     # zoho_client = ZohoClient(CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, ORGANIZATION_ID)
+    pass